@@ -454,6 +454,97 @@ def select(sql, *args):
     return _select(sql, False, *args)
 
 
+def iter_select(sql, *args, **kw):
+    '''
+    Execute select SQL and yield results one by one.
+    使用非缓冲的 cursor，每次从服务端取 size 行（默认 100），内存占用与结果集大小无关
+    非缓冲的 cursor 在读完结果前会占住所在的连接，因此这里通过 engine 单独打开一个连接，
+    不使用当前线程的 _db_ctx 连接，遍历过程中仍可以执行其他 SQL；
+    也因此读不到当前事务中尚未提交的数据
+    提前结束遍历（break、异常或生成器被回收）时，会先读完并丢弃剩余的行，再关闭 cursor 和连接
+
+    >>> u1 = dict(id=400, name='Tom', email='tom@test.org', passwd='cat', last_modified=time.time())
+    >>> u2 = dict(id=401, name='Jerry', email='jerry@test.org', passwd='mouse', last_modified=time.time())
+    >>> insert('user', **u1)
+    1
+    >>> insert('user', **u2)
+    1
+    >>> [u.name for u in iter_select('select * from user where id in (?, ?) order by id', 400, 401, size=1)]
+    [u'Tom', u'Jerry']
+    >>> list(iter_select('select * from user where id=?', 900900900))
+    []
+    >>> with connection():
+    ...     for u in iter_select('select * from user where id in (?, ?) order by id', 400, 401, size=1):
+    ...         break
+    ...     u2 = select_one('select * from user where id=?', 401)
+    >>> u.name, u2.name
+    (u'Tom', u'Jerry')
+    >>> L = []
+    >>> for u in iter_select('select * from user where id in (?, ?) order by id', 400, 401, size=1):
+    ...     n = update('update user set passwd=? where id=?', 'x', u.id)
+    ...     L.append(select_one('select * from user where id=?', u.id).passwd)
+    >>> L
+    [u'x', u'x']
+    '''
+    size = kw.get('size', 100)
+    sql = sql.replace('?', '%s')
+    logging.info('SQL: %s, ARGS: %s' % (sql, args))
+    connection = engine.connect()
+    logging.info('open streaming connection <%s>...' % hex(id(connection)))
+    cursor = None
+    pending = False
+    try:
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(sql, args)
+        pending = True
+        names = [x[0] for x in cursor.description]
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                pending = False
+                break
+            for x in rows:
+                yield Dict(names, x)
+    finally:
+        try:
+            if cursor:
+                # consumer stopped early, discard the unread rows before closing:
+                if pending:
+                    while cursor.fetchmany(size):
+                        pass
+                cursor.close()
+        finally:
+            logging.info('close streaming connection <%s>...' % hex(id(connection)))
+            connection.close()
+
+
+@with_connection
+def select_values(sql, *args):
+    '''
+    Execute select SQL and return list of value tuples or empty list if no result.
+    不为每一行构造 Dict，适合只需要值的批量读取
+
+    >>> u1 = dict(id=500, name='Ann', email='ann@test.org', passwd='ann', last_modified=time.time())
+    >>> insert('user', **u1)
+    1
+    >>> select_values('select id, name from user where id=?', 500)
+    [(500, u'Ann')]
+    >>> select_values('select id from user where id=?', 900900900)
+    []
+    '''
+    global _db_ctx
+    cursor = None
+    sql = sql.replace('?', '%s')
+    logging.info('SQL: %s, ARGS: %s' % (sql, args))
+    try:
+        cursor = _db_ctx.connection.cursor()
+        cursor.execute(sql, args)
+        return cursor.fetchall()
+    finally:
+        if cursor:
+            cursor.close()
+
+
 @with_connection
 def _update(sql, *args):
     global _db_ctx
@@ -3,9 +3,11 @@
 
 '''
 Database operation module. This module is independent with web module.
+
+Model.find_all_arr requires the optional dependency numpy, other functions do not.
 '''
 
-import time, logging
+import time, logging, itertools
 
 import db
 
@@ -13,8 +15,10 @@ class Field(object):
     '''
     保存数据库中表的“字段属性”
 
-    _count：类属性，每实例化一次，该值就 +1
-    self._order：实例属性，实例化时从类属性 _count 处得到，用于记录该实例是该类的第几个实例
+    _counter：类属性，itertools.count 计数器，每实例化一次取下一个值
+        Python 2 的类定义字典不保留字段的定义顺序，因此仍需要计数器记录顺序；
+        next() 在 C 层完成取值和递增，不会像 _count += 1 那样在多线程定义类时出现竞争
+    self._order：实例属性，实例化时从类属性 _counter 处得到，用于记录该实例是该类的第几个实例
         例如在最后的 doctest 中：
             定义 user 时该类进行了 5 次实例化，来保存字段属性：
                 id = IntegerField(primary_key=True)
@@ -39,9 +43,16 @@ class Field(object):
                 );
     self.default：用于让 orm 自己填入缺省值，缺省值可以是可调用对象，比如函数
         例如：passwd 字段的默认值，就可以通过返回的函数调用取得
+    self._default_is_callable，self._default_value：实例化时预先判断缺省值是否可调用，
+        避免每次取缺省值时都调用 callable()
+    self._quoted_name：加上反引号的字段名，比如 `id`，由 ModelMetaclass 在确定字段名后设置
     其他的实例属性都是用来描述字段属性的
+    使用 __slots__ 保存实例属性，不再为每个字段对象分配 __dict__
     '''
-    _count = 0
+    __slots__ = ('name', '_default', 'primary_key', 'nullable', 'updatable', 'insertable', 'ddl',
+                 '_default_is_callable', '_default_value', '_order', '_quoted_name')
+
+    _counter = itertools.count()
 
     def __init__(self, **kw):
         self.name = kw.get('name', None)
@@ -51,16 +62,17 @@ class Field(object):
         self.updatable = kw.get('updatable', True)
         self.insertable = kw.get('insertable', True)
         self.ddl = kw.get('ddl', '')
-        self._order = Field._count
-        Field._count = Field._count + 1
+        # _default 在实例化后不再改变，因此只判断一次是否可调用：
+        self._default_is_callable = callable(self._default)
+        self._default_value = None if self._default_is_callable else self._default
+        self._order = next(Field._counter)
 
     @property
     def default(self):
         '''
         利用 getter 实现的一个写保护的实例属性
         '''
-        d = self._default
-        return d() if callable(d) else d
+        return self._default() if self._default_is_callable else self._default_value
 
     def __str__(self):
         '''
@@ -68,18 +80,18 @@ class Field(object):
             <IntegerField:id,bigint,default(0),UI>
             类：实例：实例 ddl 属性，实例 default 信息，3 种标志位：N U I
         '''
-        s = ['<%s:%s,%s,default(%s),' % (self.__class__.__name__, self.name, self.ddl, self._default)]
-        self.nullable and s.append('N')
-        self.updatable and s.append('U')
-        self.insertable and s.append('I')
-        s.append('>')
-        return ''.join(s)
+        return '<%s:%s,%s,default(%s),%s%s%s>' % (self.__class__.__name__, self.name, self.ddl, self._default,
+                                                  'N' if self.nullable else '',
+                                                  'U' if self.updatable else '',
+                                                  'I' if self.insertable else '')
 
 
 class StringField(Field):
     '''
     保存 String 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, **kw):
         if 'default' not in kw:
             kw['default'] = ''
@@ -92,6 +104,8 @@ class IntegerField(Field):
     '''
     保存 Integer 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, **kw):
         if 'default' not in kw:
             kw['default'] = 0
@@ -104,6 +118,8 @@ class FloatField(Field):
     '''
     保存 Float 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, **kw):
         if 'default' not in kw:
             kw['default'] = 0.0
@@ -116,6 +132,8 @@ class BooleanField(Field):
     '''
     保存 Boolean 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, **kw):
         if 'default' not in kw:
             kw['default'] = False
@@ -128,11 +146,13 @@ class TextField(Field):
     '''
     保存 Text 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, **kw):
         if 'default' not in kw:
             kw['default'] = ''
         if 'ddl' not in kw:
-            kw['dll'] = 'text'
+            kw['ddl'] = 'text'
         super(TextField, self).__init__(**kw)
 
 
@@ -140,6 +160,8 @@ class BlobField(Field):
     '''
     保存 Blob 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, **kw):
         if 'default' not in kw:
             kw['default'] = ''
@@ -152,21 +174,53 @@ class VersionField(Field):
     '''
     保存 Version 类型字段的属性
     '''
+    __slots__ = ()
+
     def __init__(self, name=None):
         super(VersionField, self).__init__(name=name, default=0, ddl='bigint')
 
 
 _triggers = frozenset(['pre_insert', 'pre_update', 'pre_delete'])
 
+# 数值类型字段对应的 numpy dtype，用于 Model.find_all_arr：
+_numeric_dtypes = {
+    IntegerField: 'i8',
+    VersionField: 'i8',
+    FloatField: 'f8',
+    BooleanField: '?',
+}
 
-def _gen_sql(table_name, mappings):
+# 哨兵对象，用于区分“未赋值”与“值为 None”
+_MISSING = object()
+
+
+def _gen_sql(table_name, fields):
     '''
     类 ==> 表时，生成创建表的 sql
+    fields 为已按 _order 排好序的字段对象，仅在创建类时调用一次
+    字段没有 ddl 时（比如直接使用 Field()），创建类时就会抛出 StandardError
+
+    >>> class Article(Model):
+    ...     id = IntegerField(primary_key=True)
+    ...     content = TextField()
+    >>> print Article.__sql_text__
+    -- generating SQL for article:
+    create table `article` (
+      `id` bigint not null,
+      `content` text not null,
+      primary key(`id`)
+    );
+    >>> class Note(Model):
+    ...     id = IntegerField(primary_key=True)
+    ...     body = Field()
+    Traceback (most recent call last):
+        ...
+    StandardError: no ddl in field "<Field:body,,default(None),UI>".
     '''
     pk = None
     sql = ['-- generating SQL for %s:' % table_name, 'create table `%s` (' % table_name]
-    for f in sorted(mappings.values(), lambda x, y: cmp(x._order, y._order)):
-        if not hasattr(f, 'ddl'):
+    for f in fields:
+        if not f.ddl:
             raise StandardError('no ddl in field "%s".' % f)
         ddl = f.ddl
         nullable = f.nullable
@@ -179,6 +233,44 @@ def _gen_sql(table_name, mappings):
     return '\n'.join(sql)
 
 
+def _gen_init(keys):
+    '''
+    类 ==> 表时，生成该类专用的 __init__ 函数
+    每个字段对应一个关键字参数，直接写入 slot，避免 **kw 构造字典
+    不是字段的关键字参数（比如表单中多余的键）由 **_kw 接收后丢弃
+    '''
+    src = ['def __init__(self, %s, **_kw):' % ', '.join(['%s=_MISSING' % k for k in keys])]
+    for k in keys:
+        src.append('    if %s is not _MISSING: self.%s = %s' % (k, k, k))
+    ns = {'_MISSING': _MISSING}
+    exec '\n'.join(src) in ns
+    return ns['__init__']
+
+
+def _gen_from_row(items):
+    '''
+    类 ==> 表时，生成从查询结果（行）构造实例的函数
+    按列名直接从行中取值写入 slot，不再经过 cls(**d)
+    行中没有的列（比如表还未迁移）不赋值，与 cls(**d) 一样保持该属性不存在
+
+    >>> class Reader(Model):
+    ...     __table__ = 'user'
+    ...     id = IntegerField(primary_key=True)
+    ...     name = StringField()
+    ...     nickname = StringField()
+    >>> r = Reader._from_row({'id': 1, 'name': u'Foo'})
+    >>> r.name, hasattr(r, 'nickname')
+    (u'Foo', False)
+    '''
+    src = ['def _from_row(cls, d):', '    self = cls.__new__(cls)']
+    for k, v in items:
+        src.append('    if %r in d: self.%s = d[%r]' % (v.name, k, v.name))
+    src.append('    return self')
+    ns = {}
+    exec '\n'.join(src) in ns
+    return ns['_from_row']
+
+
 class ModelMetaclass(type):
     '''
     对类对象动态完成以下操作：
@@ -186,62 +278,128 @@ class ModelMetaclass(type):
         1. 排除对 Model 类的修改
     属性与字段的 mapping
         1. 从类的属性字典中提取出类属性和字段类的 mapping
-        2. 提取完成后移除这些类属性，避免和实例属性冲突
+        2. 新的类属性字典中不包含这些类属性，避免和实例属性冲突，并将字段的属性名设为 __slots__
+           字段名与 Model 的方法（比如 items、update）或触发器重名时抛出 TypeError，
+           否则 slot 会覆盖同名方法
         3. 新增 __mappings__ 属性，保存提取出来的 mapping 数据
+        4. 为每个字段预先生成加上反引号的字段名 _quoted_name
     类和表的 mapping
         1. 提取类名，保存为表名，完成简单的类和表的映射
         2. 新增 __table__ 属性，保存提取出来的表名
+        3. 新增 __quoted_table__ 属性，保存加上反引号的表名
+    预先计算类级别的元数据，避免每次调用时重复计算
+        1. 按定义顺序排好字段，保存为 __sorted_fields__ 属性
+        2. 一次性生成建表 sql，保存为 __sql_text__ 属性，__sql__ 直接返回该字符串
+        3. 生成 insert、update、delete 的 sql 模板，保存为 __insert_sql__、__update_sql__、__delete_sql__ 属性
+        4. 生成可插入、可更新字段的执行计划 (属性名, 缺省值, 缺省值是否可调用)，
+           保存为 __insert_plan__、__update_plan__ 属性
+        5. 生成查询的 sql，保存为 __select_sql__、__get_sql__、__count_all_sql__ 属性，
+           find_first、find_by、count_by 在其后拼接 where 语句
+        6. 生成该类专用的 __init__ 和 _from_row，实例化和从行构造实例时直接写入 slot
+        7. 字段全部为非空的数值类型时，生成 numpy dtype，保存为 __numeric_dtype__ 属性，否则为 None，
+           同时生成按 dtype 顺序查询各列的 sql，保存为 __numeric_select_sql__ 属性
+        8. 预先判断是否定义了 pre_insert 等触发器，保存为 __has_pre_insert__ 等布尔属性
     '''
+    # all subclasses info:
+    subclasses = {}
+
     def __new__(cls, name, bases, attrs):
         # skip base Model class:
         if name == 'Model':
             return type.__new__(cls, name, bases, attrs)
 
-        # store all subclasses info:
-        if not hasattr(cls, 'subclasses'):
-            cls.subclasses = {}
-        if name not in cls.subclasses:
-            cls.subclasses[name] = name
-        else:
-            logging.warning('Redefine class: %s' % name)
+        if name in cls.subclasses:
+            logging.warning('Redefine class: %s', name)
+        cls.subclasses[name] = name
 
-        logging.info('Scan ORMapping %s...' % name)
-        mappings = dict()
+        logging.info('Scan ORMapping %s...', name)
+        # split fields from other class attributes instead of popping them afterwards:
+        mappings = {k: v for k, v in attrs.iteritems() if isinstance(v, Field)}
+        attrs = {k: v for k, v in attrs.iteritems() if not isinstance(v, Field)}
         primary_key = None
-        for k, v in attrs.iteritems():
-            if isinstance(v, Field):
-                if not v.name:
-                    v.name = k
-                logging.info('Found mapping: %s => %s' % (k, v))
-                # check duplicate primary key:
-                if v.primary_key:
-                    if primary_key:
-                        raise TypeError('Cannot define more than 1 primary key in class: %s' % name)
-                    if v.updatable:
-                        logging.warning('NOTE: change primary key to non-updatable.')
-                        v.updatable = False
-                    if v.nullable:
-                        logging.warning('NOTE: change primary key to non-nullable.')
-                        v.nullable = False
-                    primary_key = v
-                mappings[k] = v
+        primary_key_attr = None
+        for k, v in mappings.iteritems():
+            # a field's slot would hide the Model method or trigger of the same name:
+            if k in _triggers or any(hasattr(b, k) for b in bases):
+                raise TypeError('Field name conflicts with Model attribute in class %s: %s' % (name, k))
+            if not v.name:
+                v.name = k
+            v._quoted_name = '`%s`' % v.name
+            logging.info('Found mapping: %s => %s', k, v)
+            # check duplicate primary key:
+            if v.primary_key:
+                if primary_key:
+                    raise TypeError('Cannot define more than 1 primary key in class: %s' % name)
+                if v.updatable:
+                    logging.warning('NOTE: change primary key to non-updatable.')
+                    v.updatable = False
+                if v.nullable:
+                    logging.warning('NOTE: change primary key to non-nullable.')
+                    v.nullable = False
+                primary_key = v
+                primary_key_attr = k
         # check exist of primary key:
         if not primary_key:
             raise TypeError('Primary key not defined in class: %s' % name)
-        for k in mappings.iterkeys():
-            attrs.pop(k)
         if '__table__' not in attrs:
             attrs['__table__'] = name.lower()
+        attrs['__quoted_table__'] = '`%s`' % attrs['__table__']
         attrs['__mappings__'] = mappings
         attrs['__primary_key__'] = primary_key
-        attrs['__sql__'] = lambda self: _gen_sql(attrs['__table__'], mappings)
+        # values live in slots named after the attribute, which may differ from the column name:
+        attrs['__primary_key_attr__'] = primary_key_attr
+        # decorate-sort-undecorate on the unique _order, so sorting never calls back into Python:
+        items = [(k, v) for o, k, v in sorted((v._order, k, v) for k, v in mappings.iteritems())]
+        sorted_fields = tuple(v for k, v in items)
+        attrs['__sorted_fields__'] = sorted_fields
+        ddl = _gen_sql(attrs['__table__'], sorted_fields)
+        attrs['__sql_text__'] = ddl
+        attrs['__sql__'] = lambda self, _s=ddl: _s
+        # store row values in slots named after the fields:
+        attrs['__slots__'] = tuple(k for k, v in items)
+        attrs['__init__'] = _gen_init(attrs['__slots__'])
+        attrs['_from_row'] = classmethod(_gen_from_row(items))
+        # pre-build write SQL and per-field plans:
+        table = attrs['__quoted_table__']
+        insert_fields = [(k, v) for k, v in items if v.insertable]
+        update_fields = [(k, v) for k, v in items if v.updatable]
+        attrs['__insert_plan__'] = tuple((k, v._default, v._default_is_callable) for k, v in insert_fields)
+        attrs['__update_plan__'] = tuple((k, v._default, v._default_is_callable) for k, v in update_fields)
+        attrs['__insert_sql__'] = 'insert into %s (%s) values (%s)' % (table, ', '.join([v._quoted_name for k, v in insert_fields]), ', '.join(['?'] * len(insert_fields)))
+        attrs['__update_sql__'] = 'update %s set %s where %s=?' % (table, ','.join(['%s=?' % v._quoted_name for k, v in update_fields]), primary_key._quoted_name)
+        attrs['__delete_sql__'] = 'delete from %s where %s=?' % (table, primary_key._quoted_name)
+        # pre-build read SQL, the where clause is appended at call time:
+        attrs['__select_sql__'] = 'select * from %s' % table
+        attrs['__get_sql__'] = 'select * from %s where %s=?' % (table, primary_key._quoted_name)
+        attrs['__count_all_sql__'] = 'select count(%s) from %s' % (primary_key._quoted_name, table)
+        # all fields numeric and not nullable, rows can be packed into a numpy structured array:
+        dtypes = [_numeric_dtypes.get(type(v)) for v in sorted_fields]
+        if all(dtypes) and not any(v.nullable for v in sorted_fields):
+            attrs['__numeric_dtype__'] = [(v.name, t) for v, t in zip(sorted_fields, dtypes)]
+            attrs['__numeric_select_sql__'] = 'select %s from %s' % (', '.join([v._quoted_name for v in sorted_fields]), table)
+        else:
+            attrs['__numeric_dtype__'] = None
         for trigger in _triggers:
             if trigger not in attrs:
                 attrs[trigger] = None
+            attrs['__has_%s__' % trigger] = callable(attrs[trigger])
         return type.__new__(cls, name, bases, attrs)
 
 
-class Model(dict):
+def _assigned_items(obj):
+    '''
+    按字段定义顺序返回实例中已赋值字段的 (属性名, 值)
+    直接遍历类的 __slots__，不经过可能被覆盖的 keys()、items()
+    '''
+    L = []
+    for k in type(obj).__slots__:
+        v = getattr(obj, k, _MISSING)
+        if v is not _MISSING:
+            L.append((k, v))
+    return L
+
+
+class Model(object):
     '''
     这是一个基类，用户在子类中定义映射关系，因此我们需要动态扫描子类属性，
     从中抽取出类属性，完成 类 <==>表 的映射，这里使用 metaclass 来实现。
@@ -249,11 +407,17 @@ class Model(dict):
         '__table__'：表名
         '__mappings__'：字段对象（字段的所有属性，见 Field 类）
         '__primary_key__'：主键字段
-        '__sql__'：创建表时执行的 sql
-
-    子类在实例化时，需要完成 实例属性 <==> 行值 的映射，这里使用定制 dict 来实现。
-        Model 从字典继承而来，并且通过 __getattr__，__setattr__ 将 Model 重写，
-        使其可以通过属性访问值，比如：a.key = value
+        '__primary_key_attr__'：主键字段的属性名，字段用 name= 指定列名时与列名不同
+        '__sorted_fields__'：按定义顺序排列的字段对象
+        '__sql_text__'：创建表时执行的 sql
+        '__sql__'：返回 __sql_text__ 的方法
+
+    子类在实例化时，需要完成 实例属性 <==> 行值 的映射，这里使用 __slots__ 来实现。
+        metaclass 把字段的属性名作为子类的 __slots__，行值直接保存在实例的 slot 中，
+        属性访问不再经过 dict 查找，比如：a.key = value
+        同时保留 a[key]、a[key] = value、keys()、items()、len()、in 这种类似字典的访问方式，
+        只包含已赋值的字段；实例不再是 dict，序列化为 JSON 时需先转换：json.dumps(dict(a))
+        实例化时传入的非字段参数会被忽略，不会保存到实例中
 
     >>> class User(Model):
     ...     id = IntegerField(primary_key=True)
@@ -280,13 +444,59 @@ class Model(dict):
     >>> r = f.update() # change email but email is non-updatable
     >>> len(User.find_all())
     1
+    >>> [x.name for x in User.iter_all()]
+    [u'Foo']
+    >>> next(User.iter_all()).name
+    u'Foo'
     >>> g = User.get(300)
     >>> g.email
     u'orm@db.org'
     >>> r = g.delete()
     >>> len(db.select('select * from user where id=300'))
     0
+    >>> class Account(Model):
+    ...     __table__ = 'user'
+    ...     uid = IntegerField(primary_key=True, name='id')
+    ...     nick = StringField(name='name')
+    ...     email = StringField()
+    ...     passwd = StringField()
+    ...     last_modified = FloatField()
+    >>> r = Account(uid=301, nick='Bar', email='bar@db.org').insert()
+    >>> a = Account.get(301)
+    >>> a.uid, a.nick
+    (301, u'Bar')
+    >>> a.nick = 'Baz'
+    >>> r = a.update()
+    >>> Account.get(301).nick
+    u'Baz'
+    >>> r = a.delete()
+    >>> Account.get(301) is None
+    True
+    >>> v = User(id=1, name='a')
+    >>> bool(v), len(v), 'name' in v, 'email' in v
+    (True, 2, True, False)
+    >>> bool(User())
+    False
+    >>> v.keys()
+    ['id', 'name']
+    >>> v
+    User(id=1, name='a')
     >>> import json
+    >>> json.dumps(dict(v), sort_keys=True)
+    '{"id": 1, "name": "a"}'
+    >>> User(id=1, name='a', foo='ignored') == v
+    True
+    >>> v == User(name='a', id=1), v == User(id=2, name='a'), v != User(id=1)
+    (True, False, True)
+    >>> import copy
+    >>> copy.copy(v) == v
+    True
+    >>> class Bad(Model):
+    ...     id = IntegerField(primary_key=True)
+    ...     items = TextField()
+    Traceback (most recent call last):
+        ...
+    TypeError: Field name conflicts with Model attribute in class Bad: items
     >>> print User().__sql__()
     -- generating SQL for user:
     create table `user` (
@@ -297,36 +507,86 @@ class Model(dict):
       `last_modified` real not null,
       primary key(`id`)
     );
+    >>> User.__sql_text__ == User().__sql__()
+    True
     '''
     __metaclass__ = ModelMetaclass
+    __slots__ = ()
 
     def __init__(self, **kw):
-        super(Model, self).__init__(**kw)
+        for k, v in kw.iteritems():
+            setattr(self, k, v)
+
+    def __getitem__(self, key):
+        '''
+        get 时生效，比如 a[key]；key 为字段的属性名
+        未赋值或不是字段时抛出 KeyError
+        '''
+        if key in self.__mappings__:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        '''
+        set 时生效，比如 a[key] = value
+        '''
+        if key not in self.__mappings__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__mappings__ and hasattr(self, key)
+
+    def keys(self):
+        '''
+        返回已赋值字段的属性名，按字段定义顺序排列
+        '''
+        return [k for k, v in _assigned_items(self)]
 
-    def __getattr__(self, key):
+    def items(self):
         '''
-        get 时生效，比如 a[key]，a.get(key)；key 为 string
-        get 时返回属性的值
+        返回已赋值字段的 (属性名, 值)，按字段定义顺序排列
         '''
-        try:
-            return self[key]
-        except KeyError:
-            raise AttributeError(r"'Dict' object has no attribute '%s'" % key)
+        return _assigned_items(self)
 
-    def __setattr__(self, key, value):
+    def __iter__(self):
+        return iter([k for k, v in _assigned_items(self)])
+
+    def __len__(self):
+        return len(_assigned_items(self))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and _assigned_items(self) == _assigned_items(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    # 与 dict 一样，实例可变，因此不可哈希：
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(['%s=%r' % kv for kv in _assigned_items(self)]))
+
+    def __getstate__(self):
         '''
-        set 时生效，比如 a[key] = value，a = {'key1': value1, 'key2': value2}
-        set 时添加属性与值
+        使用 __slots__ 后没有 __dict__，pickle 时需要显式提供状态
         '''
-        self[key] = value
+        return dict(_assigned_items(self))
+
+    def __setstate__(self, state):
+        for k, v in state.iteritems():
+            setattr(self, k, v)
 
     @classmethod
     def get(cls, pk):
         '''
         Get by primary key.
         '''
-        d = db.select_one('select * from %s where %s=?' % (cls.__table__, cls.__primary_key__.name), pk)
-        return cls(**d) if d else None
+        d = db.select_one(cls.__get_sql__, pk)
+        return cls._from_row(d) if d else None
 
     @classmethod
     def find_first(cls, where, *args):
@@ -335,8 +595,8 @@ class Model(dict):
         如有多个结果，仅取第一个；如没有结果，返回 None
         Like 'select * from table where arg=%s'
         '''
-        d = db.select_one('select * from %s %s' % (cls.__table__, where), *args)
-        return cls(**d) if d else None
+        d = db.select_one('%s %s' % (cls.__select_sql__, where), *args)
+        return cls._from_row(d) if d else None
 
     @classmethod
     # def find_all(cls, *args):
@@ -344,8 +604,80 @@ class Model(dict):
         '''
         Find all and return list.
         '''
-        L = db.select('select * from %s' % cls.__table__)
-        return [cls(**d) for d in L]
+        L = db.select(cls.__select_sql__)
+        from_row = cls._from_row
+        return [from_row(d) for d in L]
+
+    @classmethod
+    def iter_all(cls):
+        '''
+        Find all and return generator.
+        通过 db.iter_select 逐行读取并构造实例，内存占用与表的行数无关
+        db.iter_select 使用单独的连接，因此遍历时仍可以调用 update、get、find_* 等方法，
+        但读不到当前事务中尚未提交的数据
+        需要 list 时使用 find_all
+
+        >>> class Member(Model):
+        ...     __table__ = 'user'
+        ...     id = IntegerField(primary_key=True)
+        ...     name = StringField()
+        ...     email = StringField()
+        ...     passwd = StringField()
+        ...     last_modified = FloatField()
+        >>> r = Member(id=700, name='Ann').insert()
+        >>> r = Member(id=701, name='Bob').insert()
+        >>> for m in Member.iter_all():
+        ...     if m.id in (700, 701):
+        ...         m.passwd = 'streamed'
+        ...         r = m.update()
+        >>> Member.get(700).passwd, Member.get(701).passwd
+        (u'streamed', u'streamed')
+        >>> r = Member.get(700).delete()
+        >>> r = Member.get(701).delete()
+        '''
+        from_row = cls._from_row
+        for d in db.iter_select(cls.__select_sql__):
+            yield from_row(d)
+
+    @classmethod
+    def find_all_arr(cls):
+        '''
+        Find all and return numpy record array.
+        仅适用于字段全部为非空数值类型的类，所有行保存在一个结构化数组中，
+        不再为每一行构造实例，也不构造 Dict，查询返回的值元组直接交给 numpy
+        适合大量数值数据的分析读取，需要安装 numpy
+
+        >>> class Point(Model):
+        ...     id = IntegerField(primary_key=True)
+        ...     x = FloatField()
+        ...     visible = BooleanField()
+        >>> Point.__numeric_dtype__
+        [('id', 'i8'), ('x', 'f8'), ('visible', '?')]
+        >>> n = db.update('drop table if exists point')
+        >>> n = db.update('create table point (id bigint primary key, x real, visible bool)')
+        >>> r = Point(id=1, x=0.5, visible=True).insert()
+        >>> r = Point(id=2, x=1.5).insert()
+        >>> a = Point.find_all_arr()
+        >>> a.id.tolist(), a.x.tolist(), a.visible.tolist()
+        ([1, 2], [0.5, 1.5], [True, False])
+        >>> a[0].x
+        0.5
+        >>> n = db.update('drop table point')
+        >>> class Named(Model):
+        ...     id = IntegerField(primary_key=True)
+        ...     name = StringField()
+        >>> Named.__numeric_dtype__ is None
+        True
+        >>> Named.find_all_arr()
+        Traceback (most recent call last):
+            ...
+        TypeError: Not all fields are numeric in class: Named
+        '''
+        dtype = cls.__numeric_dtype__
+        if dtype is None:
+            raise TypeError('Not all fields are numeric in class: %s' % cls.__name__)
+        import numpy
+        return numpy.array(db.select_values(cls.__numeric_select_sql__), dtype=dtype).view(numpy.recarray)
 
     @classmethod
     def find_by(cls, where, *args):
@@ -353,8 +685,9 @@ class Model(dict):
         Find by where clause and return list.
         where 条件查询，返回 list
         '''
-        L = db.select('select * from `%s` %s' % (cls.__table__, where), *args)
-        return [cls(**d) for d in L]
+        L = db.select('%s %s' % (cls.__select_sql__, where), *args)
+        from_row = cls._from_row
+        return [from_row(d) for d in L]
 
     @classmethod
     def count_all(cls):
@@ -362,70 +695,66 @@ class Model(dict):
         Find by 'select count(pk) from table' and return integer.
         返回数值
         '''
-        return db.select_int('select count(`%s`) from `%s`' % (cls.__primary_key__.name, cls.__table__))
+        return db.select_int(cls.__count_all_sql__)
 
     @classmethod
     def count_by(cls, where, *args):
         '''
         Find by 'select count(pk) from table where ...' and return int.
         '''
-        return db.select_int('select count(`%s`) from `%s` %s' % (cls.__primary_key__.name, cls.__table__, where), *args)
+        return db.select_int('%s %s' % (cls.__count_all_sql__, where), *args)
 
     def update(self):
         '''
         如果该行的字段属性有 updatable，代表该字段可以被更新
-        用于定义的表（继承 Model 的类）是一个 Dict 对象，键值会变成实例的属性
-        所以可以通过属性来判断用户是否定义了该字段的值
+        字段的值保存在实例的 slot 中，未赋值的 slot 不存在该属性
+        所以可以通过 getattr 带缺省值一次取值来判断用户是否定义了该字段的值
             如果有属性，则使用用户传入的值
-            如果无属性，则调用字段对象的 default 属性传入
-            具体见 Field 类的 default 属性
+            如果无属性，则使用字段的缺省值（可调用时调用后取得），缺省值只用于 SQL 参数，不写回实例
 
-        通过 db 对象的 update 接口执行 SQL
-            SQL: update `user` set `passwd`=%s,`last_modified`=%s,`name`=%s where id=%s,
-                    ARGS: (u'******', 1508813773.294855, u'Foo', 300)
+        通过 db 对象的 update 接口执行预先生成的 SQL
+            SQL: update `user` set `name`=%s,`passwd`=%s,`last_modified`=%s where `id`=%s,
+                    ARGS: (u'Foo', u'******', 1508813773.294855, 300)
         '''
-        self.pre_update and self.pre_update()
-        L = []
+        if self.__has_pre_update__:
+            self.pre_update()
         args = []
-        for k, v in self.__mappings__.iteritems():
-            if v.updatable:
-                if hasattr(self, k):
-                    arg = getattr(self, k)
-                else:
-                    arg = v.default
-                    setattr(self, k, arg)
-                L.append('`%s`=?' % k)
-                args.append(arg)
-        pk = self.__primary_key__.name
-        args.append(getattr(self, pk))
-        db.update('update `%s` set %s where %s=?' % (self.__table__, ','.join(L), pk), *args)
+        for k, default, is_callable in self.__update_plan__:
+            arg = getattr(self, k, _MISSING)
+            if arg is _MISSING:
+                arg = default() if is_callable else default
+            args.append(arg)
+        args.append(getattr(self, self.__primary_key_attr__))
+        db.update(self.__update_sql__, *args)
         return self
 
     def delete(self):
         '''
-        通过 db 对象的 update 接口执行 SQL
+        通过 db 对象的 update 接口执行预先生成的 SQL
             SQL: delete from `user` where `id`=%s, ARGS:(300,)
         '''
-        self.pre_delete and self.pre_delete()
-        pk = self.__primary_key__.name
-        args = (getattr(self, pk), )
-        db.update('delete from `%s` where `%s`=?' % (self.__table__, pk), *args)
+        if self.__has_pre_delete__:
+            self.pre_delete()
+        db.update(self.__delete_sql__, getattr(self, self.__primary_key_attr__))
         return self
 
     def insert(self):
         '''
-        通过 db 对象的 insert 接口执行 SQL
-            SQL: insert into `user` (`passwd`,`last_modified`,`id`,`name`,`email`) values (%s,%s,%s,%s,%s),
-                    ARGS: ('******', 1508813773.294855, 300, u'Foo', 'orm@db.org')
-        '''
-        self.pre_insert and self.pre_insert()
-        params = {}
-        for k, v in self.__mappings__.iteritems():
-            if v.insertable:
-                if not hasattr(self, k):
-                    setattr(self, k, v.default)
-                params[v.name] = getattr(self, k)
-        db.insert('%s' % self.__table__, **params)
+        通过 db 对象的 update 接口执行预先生成的 insert SQL
+        用 getattr 带缺省值一次取值，避免 hasattr + getattr 两次查找
+            SQL: insert into `user` (`id`, `name`, `email`, `passwd`, `last_modified`) values (%s, %s, %s, %s, %s),
+                    ARGS: (300, u'Foo', 'orm@db.org', '******', 1508813773.294855)
+        '''
+        if self.__has_pre_insert__:
+            self.pre_insert()
+        args = []
+        for k, default, is_callable in self.__insert_plan__:
+            arg = getattr(self, k, _MISSING)
+            if arg is _MISSING:
+                arg = default() if is_callable else default
+                setattr(self, k, arg)
+            args.append(arg)
+        db.update(self.__insert_sql__, *args)
         return self
 
 